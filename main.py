@@ -1,15 +1,27 @@
 import os
-import re
-import json
+import html
 import random
 import asyncio
 import logging
 import hashlib
-from typing import Optional, Dict, Any, List
+import time
+import weakref
+import itertools
+from collections import defaultdict
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple, FrozenSet, Awaitable, Callable
 
 import aiohttp
+import orjson
+
+try:
+    import uvloop
+except ImportError:  # uvloop нет под Windows — там работаем на стандартном цикле
+    uvloop = None
 from telegram import (
     Update,
+    CallbackQuery,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
@@ -17,6 +29,7 @@ from telegram.constants import ParseMode
 from telegram.ext import (
     Application,
     ApplicationBuilder,
+    BaseUpdateProcessor,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
@@ -37,18 +50,24 @@ WEBHOOK_URL  = os.getenv("WEBHOOK_URL", "").strip()
 PORT         = int(os.getenv("PORT", "8080"))
 WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "").strip()
 
+# Сколько апдейтов (от разных пользователей) обрабатываем одновременно
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+
+# Лимит длины текста одного сообщения Telegram
+TG_MESSAGE_LIMIT = 4096
+
 # Единый аккаунт студии — для всех балансовых операций
 STUDIO_ACCOUNT_ID = int(os.getenv("STUDIO_ACCOUNT_ID", "419675968"))
 
-def _parse_ids(env_var: str) -> List[int]:
+def _parse_ids(env_var: str) -> FrozenSet[int]:
     val = os.getenv(env_var, "").strip()
-    return [int(x.strip()) for x in val.split(",") if x.strip()] if val else []
+    return frozenset(int(x.strip()) for x in val.split(",") if x.strip()) if val else frozenset()
 
 OWNER_IDS = _parse_ids("OWNER_IDS")
 ADMIN_IDS = _parse_ids("ADMIN_IDS")
 
 # Общий allowlist
-USER_TG_IDS = list(set(OWNER_IDS + ADMIN_IDS))
+USER_TG_IDS = OWNER_IDS | ADMIN_IDS
 
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN is missing")
@@ -66,13 +85,6 @@ def _default_webhook_path() -> str:
 # ========================================
 # РОЛИ
 # ========================================
-def get_role(user_id: int) -> str:
-    """Возвращает 'owner' | 'admin'"""
-    if user_id in OWNER_IDS:
-        return "owner"
-    return "admin"
-
-
 def is_owner(user_id: int) -> bool:
     return user_id in OWNER_IDS
 
@@ -87,20 +99,24 @@ def is_allowed(update: Update) -> bool:
 # ========================================
 # ФРАЗЫ
 # ========================================
-PH_SAVED_INCOME = [
+PH_SAVED_INCOME = (
     "Отлично! ✅ Записал поступление.",
     "Есть! ✅ Зафиксировал.",
     "Принял ✅",
     "Готово ✅",
-]
+)
 
-PH_SAVED_EXPENSE = [
+PH_SAVED_EXPENSE = (
     "Записал ✅",
     "Готово ✅",
     "Зафиксировал ✅",
     "Есть ✅",
     "Принял ✅",
-]
+)
+
+# Фразы идут по кругу — для разнообразия ответов случайность не нужна
+_PH_SAVED_INCOME_CYCLE  = itertools.cycle(PH_SAVED_INCOME)
+_PH_SAVED_EXPENSE_CYCLE = itertools.cycle(PH_SAVED_EXPENSE)
 
 DENY_TEXT = "Извини, доступ закрыт 🙂"
 
@@ -136,47 +152,72 @@ DENY_TEXT = "Извини, доступ закрыт 🙂"
 # ========================================
 # ВСПОМОГАТЕЛЬНЫЕ
 # ========================================
-async def delete_working_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+async def _delete_message_quietly(context: ContextTypes.DEFAULT_TYPE, chat_id: int, msg_id: int):
+    try:
+        await context.bot.delete_message(chat_id=chat_id, message_id=msg_id)
+    except Exception as e:
+        logger.debug(f"Couldn't delete message {msg_id}: {e}")
+
+
+def delete_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Удаляет введённое пользователем сообщение в фоне, не задерживая ответ."""
+    msg = update.message
+    context.application.create_task(_delete_message_quietly(context, msg.chat_id, msg.message_id))
+
+
+def delete_working_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    """Удаляет рабочее сообщение в фоне — следующий экран не ждёт ответа Telegram."""
     msg_id = context.user_data.get("working_message_id")
     if msg_id:
-        try:
-            await context.bot.delete_message(chat_id=chat_id, message_id=msg_id)
-        except Exception as e:
-            logger.debug(f"Couldn't delete message {msg_id}: {e}")
+        context.application.create_task(_delete_message_quietly(context, chat_id, msg_id))
     context.user_data["working_message_id"] = None
 
 
 # ========================================
 # КЛАВИАТУРЫ
 # ========================================
+# Статичные клавиатуры собираются один раз при импорте:
+# InlineKeyboardMarkup в PTB неизменяемый, делить его между апдейтами безопасно.
+_KB_MAIN_OWNER = InlineKeyboardMarkup([
+    [InlineKeyboardButton("➕ Внести транзакцию",    callback_data="menu:add")],
+    [InlineKeyboardButton("📦 Продал пленку",         callback_data="menu:film")],
+    [InlineKeyboardButton("💰 Долги перед Inside",    callback_data="menu:debts_owe_us")],
+    [InlineKeyboardButton("💳 Долги Inside",          callback_data="menu:debts_we_owe")],
+    [InlineKeyboardButton("📊 Анализ",               callback_data="menu:analysis")],
+    [InlineKeyboardButton("⚙️ Корректировать баланс", callback_data="menu:balance")],
+])
+
+
 def kb_main_owner() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("➕ Внести транзакцию",    callback_data="menu:add")],
-        [InlineKeyboardButton("📦 Продал пленку",         callback_data="menu:film")],
-        [InlineKeyboardButton("💰 Долги перед Inside",    callback_data="menu:debts_owe_us")],
-        [InlineKeyboardButton("💳 Долги Inside",          callback_data="menu:debts_we_owe")],
-        [InlineKeyboardButton("📊 Анализ",               callback_data="menu:analysis")],
-        [InlineKeyboardButton("⚙️ Корректировать баланс", callback_data="menu:balance")],
-    ])
+    return _KB_MAIN_OWNER
+
+
+_KB_MAIN_ADMIN = InlineKeyboardMarkup([
+    [InlineKeyboardButton("➕ Внести транзакцию", callback_data="menu:add")],
+    [InlineKeyboardButton("📦 Продал пленку",     callback_data="menu:film")],
+    [InlineKeyboardButton("💰 Долги перед Inside", callback_data="menu:debts_owe_us")],
+])
 
 
 def kb_main_admin() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("➕ Внести транзакцию", callback_data="menu:add")],
-        [InlineKeyboardButton("📦 Продал пленку",     callback_data="menu:film")],
-        [InlineKeyboardButton("💰 Долги перед Inside", callback_data="menu:debts_owe_us")],
-    ])
+    return _KB_MAIN_ADMIN
+
+
+_KB_CHOOSE_TYPE = InlineKeyboardMarkup([
+    [InlineKeyboardButton("➖ Затраты",  callback_data="type:expense")],
+    [InlineKeyboardButton("➕ Доход",    callback_data="type:income")],
+    [InlineKeyboardButton("⬅️ Назад",    callback_data="back:menu")],
+])
 
 
 def kb_choose_type() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("➖ Затраты",  callback_data="type:expense")],
-        [InlineKeyboardButton("➕ Доход",    callback_data="type:income")],
-        [InlineKeyboardButton("⬅️ Назад",    callback_data="back:menu")],
-    ])
+    return _KB_CHOOSE_TYPE
 
 
-def kb_expense_categories(categories: List[str]) -> InlineKeyboardMarkup:
+# Клавиатуры по спискам из GAS: список категорий меняется редко,
+# поэтому кэшируем готовую разметку по кортежу значений.
+@lru_cache(maxsize=32)
+def _kb_expense_categories(categories: Tuple[str, ...]) -> InlineKeyboardMarkup:
     rows, row = [], []
     for i, c in enumerate(categories):
         row.append(InlineKeyboardButton(c, callback_data=f"expcat:{i}"))
@@ -189,13 +230,23 @@ def kb_expense_categories(categories: List[str]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
-def kb_income_categories(categories: List[str]) -> InlineKeyboardMarkup:
+def kb_expense_categories(categories: List[str]) -> InlineKeyboardMarkup:
+    return _kb_expense_categories(tuple(categories))
+
+
+@lru_cache(maxsize=32)
+def _kb_income_categories(categories: Tuple[str, ...]) -> InlineKeyboardMarkup:
     rows = [[InlineKeyboardButton(c, callback_data=f"inccat:{i}")] for i, c in enumerate(categories)]
     rows.append([InlineKeyboardButton("⬅️ Назад", callback_data="back:choose_type")])
     return InlineKeyboardMarkup(rows)
 
 
-def kb_payment_types(payment_types: List[str]) -> InlineKeyboardMarkup:
+def kb_income_categories(categories: List[str]) -> InlineKeyboardMarkup:
+    return _kb_income_categories(tuple(categories))
+
+
+@lru_cache(maxsize=32)
+def _kb_payment_types(payment_types: Tuple[str, ...]) -> InlineKeyboardMarkup:
     rows = []
     for i, p in enumerate(payment_types):
         emoji = "💵" if p == "Наличные" else "🏢"
@@ -203,53 +254,72 @@ def kb_payment_types(payment_types: List[str]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
+def kb_payment_types(payment_types: List[str]) -> InlineKeyboardMarkup:
+    return _kb_payment_types(tuple(payment_types))
+
+
+_KB_SKIP_COMMENT = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Пропустить", callback_data="comment:skip")],
+])
+
+
 def kb_skip_comment() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("Пропустить", callback_data="comment:skip")],
-    ])
+    return _KB_SKIP_COMMENT
+
+
+_KB_ANALYSIS_PERIODS = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📅 Сегодня",              callback_data="aperiod:today")],
+    [InlineKeyboardButton("📅 Эта неделя",           callback_data="aperiod:week")],
+    [InlineKeyboardButton("📅 Этот месяц",           callback_data="aperiod:month")],
+    [InlineKeyboardButton("📅 Этот год",             callback_data="aperiod:year")],
+    [InlineKeyboardButton("⚙️ Специальные отчеты",  callback_data="aperiod:special")],
+    [InlineKeyboardButton("⬅️ Назад",                callback_data="back:menu")],
+])
 
 
 def kb_analysis_periods() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("📅 Сегодня",              callback_data="aperiod:today")],
-        [InlineKeyboardButton("📅 Эта неделя",           callback_data="aperiod:week")],
-        [InlineKeyboardButton("📅 Этот месяц",           callback_data="aperiod:month")],
-        [InlineKeyboardButton("📅 Этот год",             callback_data="aperiod:year")],
-        [InlineKeyboardButton("⚙️ Специальные отчеты",  callback_data="aperiod:special")],
-        [InlineKeyboardButton("⬅️ Назад",                callback_data="back:menu")],
-    ])
+    return _KB_ANALYSIS_PERIODS
+
+
+_KB_ANALYSIS_TYPE = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💰 Поступления",  callback_data="atype:income")],
+    [InlineKeyboardButton("💸 Затраты",      callback_data="atype:expense")],
+    [InlineKeyboardButton("⬅️ Назад",        callback_data="back:analysis_periods")],
+])
 
 
 def kb_analysis_type() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("💰 Поступления",  callback_data="atype:income")],
-        [InlineKeyboardButton("💸 Затраты",      callback_data="atype:expense")],
-        [InlineKeyboardButton("⬅️ Назад",        callback_data="back:analysis_periods")],
-    ])
+    return _KB_ANALYSIS_TYPE
+
+
+_KB_SPECIAL_REPORTS = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 Сравнение месяцев",    callback_data="special:compare")],
+    [InlineKeyboardButton("💰 Средний чек",          callback_data="special:average")],
+    [InlineKeyboardButton("📋 Топ категорий затрат", callback_data="special:top")],
+    [InlineKeyboardButton("⬅️ Назад",                callback_data="back:analysis_periods")],
+])
 
 
 def kb_special_reports() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("📊 Сравнение месяцев",    callback_data="special:compare")],
-        [InlineKeyboardButton("💰 Средний чек",          callback_data="special:average")],
-        [InlineKeyboardButton("📋 Топ категорий затрат", callback_data="special:top")],
-        [InlineKeyboardButton("⬅️ Назад",                callback_data="back:analysis_periods")],
-    ])
+    return _KB_SPECIAL_REPORTS
+
+
+_KB_BALANCE_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💵 Корректировать наличные", callback_data="balance:cash")],
+    [InlineKeyboardButton("🏢 Корректировать БН",       callback_data="balance:bn")],
+    [InlineKeyboardButton("⬅️ Назад",                   callback_data="back:menu")],
+])
 
 
 def kb_balance_menu() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("💵 Корректировать наличные", callback_data="balance:cash")],
-        [InlineKeyboardButton("🏢 Корректировать БН",       callback_data="balance:bn")],
-        [InlineKeyboardButton("⬅️ Назад",                   callback_data="back:menu")],
-    ])
+    return _KB_BALANCE_MENU
 
 
 def kb_debtors_list(debtors: List[Dict], owner_mode: bool = True) -> InlineKeyboardMarkup:
     rows = []
     for debtor in debtors:
         name   = debtor["name"]
-        amount = f"{debtor['amount']:,.0f}".replace(",", " ")
+        amount = fmt_money(debtor['amount'], 0)
         rows.append([InlineKeyboardButton(
             f"{name} — {amount} ₽",
             callback_data=f"debtor:{debtor['id']}"
@@ -260,7 +330,7 @@ def kb_debtors_list(debtors: List[Dict], owner_mode: bool = True) -> InlineKeybo
     return InlineKeyboardMarkup(rows)
 
 
-def kb_debtor_actions(owner_mode: bool = True) -> InlineKeyboardMarkup:
+def _build_debtor_actions(owner_mode: bool) -> InlineKeyboardMarkup:
     rows = []
     if owner_mode:
         rows.append([InlineKeyboardButton("✏️ Изменить сумму", callback_data="debtor:edit")])
@@ -272,65 +342,98 @@ def kb_debtor_actions(owner_mode: bool = True) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
+_KB_DEBTOR_ACTIONS_OWNER = _build_debtor_actions(True)
+_KB_DEBTOR_ACTIONS_ADMIN = _build_debtor_actions(False)
+
+
+def kb_debtor_actions(owner_mode: bool = True) -> InlineKeyboardMarkup:
+    return _KB_DEBTOR_ACTIONS_OWNER if owner_mode else _KB_DEBTOR_ACTIONS_ADMIN
+
+
+_KB_FILM_PAYMENT = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💵 Оплачено наличными", callback_data="film_payment:cash")],
+    [InlineKeyboardButton("🏢 Оплачено БН",        callback_data="film_payment:bn")],
+    [InlineKeyboardButton("📋 В долг",             callback_data="film_payment:debt")],
+    [InlineKeyboardButton("⬅️ Назад",              callback_data="back:menu")],
+])
+
+
 def kb_film_payment() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("💵 Оплачено наличными", callback_data="film_payment:cash")],
-        [InlineKeyboardButton("🏢 Оплачено БН",        callback_data="film_payment:bn")],
-        [InlineKeyboardButton("📋 В долг",             callback_data="film_payment:debt")],
-        [InlineKeyboardButton("⬅️ Назад",              callback_data="back:menu")],
-    ])
+    return _KB_FILM_PAYMENT
+
+
+_KB_DEBT_PAYMENT = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💵 Наличные",     callback_data="debt_payment:cash")],
+    [InlineKeyboardButton("🏢 БН (QR и счёт)", callback_data="debt_payment:bn")],
+])
 
 
 def kb_debt_payment() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("💵 Наличные",     callback_data="debt_payment:cash")],
-        [InlineKeyboardButton("🏢 БН (QR и счёт)", callback_data="debt_payment:bn")],
-    ])
+    return _KB_DEBT_PAYMENT
 
 
 # ========================================
 # ПАРСИНГ СУММЫ
 # ========================================
 def parse_amount(text: str) -> Optional[float]:
+    """
+    Разбирает сумму из ввода пользователя за один проход, без регулярок.
+    Последний '.' или ',' — десятичный разделитель, остальные разделители,
+    пробелы и прочие символы отбрасываются; суффикс 'к'/'k' — тысячи.
+    Отрицательные суммы и повтор десятичного разделителя не принимаются.
+    """
     if not text:
         return None
-    s0 = text.strip().lower()
+    s = text.strip().lower()
     mult = 1.0
-    s = re.sub(r"\s+", "", s0)
-    if s.endswith("к") or s.endswith("k"):
+    if s.endswith(("к", "k")):
         mult = 1000.0
         s = s[:-1]
-    has_comma = "," in s
-    has_dot   = "." in s
-    if has_comma and has_dot:
-        last_comma = s.rfind(",")
-        last_dot   = s.rfind(".")
-        dec_pos    = max(last_comma, last_dot)
-        int_part   = re.sub(r"[.,]", "", s[:dec_pos])
-        frac_part  = re.sub(r"[.,]", "", s[dec_pos + 1:])
-        s = f"{int_part}.{frac_part}"
-    elif has_comma and not has_dot:
-        s = s.replace(",", ".")
-    s = re.sub(r"[^0-9.\-]", "", s)
+    # Самый частый ввод — просто число
+    if s.isascii() and s.isdigit():
+        return round(float(s) * mult, 2)
+    if "-" in s:
+        return None
+
+    # Десятичный разделитель может встречаться только один раз:
+    # "1.234,56" и "2500,50" — да, "1.250.000" и "1,250,000" — нет (None, а не 1250)
+    dec_pos = max(s.rfind(","), s.rfind("."))
+    if dec_pos >= 0 and s.count(s[dec_pos]) > 1:
+        return None
+    chars = []
+    for i, ch in enumerate(s):
+        if "0" <= ch <= "9":
+            chars.append(ch)
+        elif i == dec_pos:
+            chars.append(".")
     try:
-        val = float(s) * mult
-        return None if val < 0 else round(val, 2)
-    except Exception:
+        return round(float("".join(chars)) * mult, 2)
+    except ValueError:
         return None
 
 
 # ========================================
-# GAS ЗАПРОСЫ (persistent session + 3 retries + 30s timeout)
+# GAS ЗАПРОСЫ (persistent session + 3 retries + 30s timeout + лимит параллельности)
 # ========================================
 _gas_session: Optional[aiohttp.ClientSession] = None
 
+# Тело запроса кодируем orjson сами, поэтому заголовок ставим явно
+_GAS_HEADERS = {"Content-Type": "application/json; charset=utf-8"}
+
+# Сколько запросов к GAS может идти одновременно: Apps Script плохо переносит
+# всплески параллельных вызовов и начинает отвечать таймаутами
+GAS_MAX_CONCURRENCY = 8
+_gas_semaphore = asyncio.Semaphore(GAS_MAX_CONCURRENCY)
+
+GAS_MAX_RETRY_DELAY = 10.0
+
 
 async def _get_gas_session() -> aiohttp.ClientSession:
     """Возвращает persistent ClientSession, создавая её при первом вызове."""
     global _gas_session
     if _gas_session is None or _gas_session.closed:
         timeout = aiohttp.ClientTimeout(total=30, connect=10)
-        connector = aiohttp.TCPConnector(limit=10, ttl_dns_cache=300)
+        connector = aiohttp.TCPConnector(limit=10, ttl_dns_cache=300, keepalive_timeout=60)
         _gas_session = aiohttp.ClientSession(timeout=timeout, connector=connector)
         logger.info("Created new GAS session")
     return _gas_session
@@ -344,57 +447,45 @@ async def _close_gas_session():
         logger.info("Closed GAS session")
 
 
+def _gas_retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    Пауза перед следующей попыткой: Retry-After от сервера (в секундах, не больше
+    GAS_MAX_RETRY_DELAY), иначе экспонента 1.5с / 3с / ... со случайным джиттером,
+    чтобы одновременно упавшие запросы не повторялись одной пачкой.
+    """
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), GAS_MAX_RETRY_DELAY)
+        except ValueError:
+            pass
+    return 1.5 * 2 ** (attempt - 1) + random.uniform(0, 0.5)
+
+
 async def gas_request(payload: Dict[str, Any], user_id: int) -> Dict[str, Any]:
     """
     Отправляет запрос в GAS с автоматическими ретраями.
-    - 3 попытки с задержкой 1.5с / 3с
-    - Ретрай на: timeout, 5xx, network errors
-    - Без ретрая на: 4xx, GAS вернул ok=false (бизнес-ошибка)
+    - 3 попытки с задержкой ~1.5с / ~3с (+ случайный джиттер)
+    - Ретрай на: timeout, 5xx, 429 (с учётом Retry-After), network errors
+    - Без ретрая на: остальные 4xx, GAS вернул ok=false (бизнес-ошибка)
     """
     payload = dict(payload)
     payload["user_id"]    = user_id
     payload["actor_id"]   = user_id
     payload["account_id"] = STUDIO_ACCOUNT_ID
 
+    body = orjson.dumps(payload)
     session = await _get_gas_session()
     max_attempts = 3
     last_error: Optional[str] = None
 
     for attempt in range(1, max_attempts + 1):
         try:
-            async with session.post(SCRIPT_URL, json=payload) as resp:
-                # 5xx — повторяем
-                if resp.status >= 500:
-                    last_error = f"HTTP {resp.status}"
-                    logger.warning(
-                        "GAS attempt %d/%d failed: %s (cmd=%s)",
-                        attempt, max_attempts, last_error, payload.get("cmd")
-                    )
-                    if attempt < max_attempts:
-                        await asyncio.sleep(1.5 * attempt)
-                        continue
-                    raise RuntimeError(f"GAS вернул {last_error} после {max_attempts} попыток")
-
-                # 4xx — не повторяем, что-то не так с запросом
-                if resp.status >= 400:
-                    txt = await resp.text()
-                    logger.error("GAS HTTP %d (cmd=%s): %s", resp.status, payload.get("cmd"), txt[:500])
-                    raise RuntimeError(f"GAS HTTP {resp.status}")
-
-                txt = await resp.text()
-                try:
-                    data = json.loads(txt)
-                except Exception:
-                    logger.error("GAS non-json response (cmd=%s): %s", payload.get("cmd"), txt[:500])
-                    raise RuntimeError("GAS вернул не-JSON ответ")
-
-                if not data.get("ok"):
-                    # Бизнес-ошибка GAS — не ретраим
-                    raise RuntimeError(data.get("error") or "GAS error")
-
-                if attempt > 1:
-                    logger.info("GAS recovered on attempt %d (cmd=%s)", attempt, payload.get("cmd"))
-                return data["data"]
+            # Семафор держим только на время HTTP-обмена, не на паузах между попытками
+            async with _gas_semaphore:
+                async with session.post(SCRIPT_URL, data=body, headers=_GAS_HEADERS) as resp:
+                    status      = resp.status
+                    retry_after = resp.headers.get("Retry-After")
+                    raw         = await resp.read()
 
         except asyncio.TimeoutError:
             last_error = "timeout"
@@ -403,7 +494,7 @@ async def gas_request(payload: Dict[str, Any], user_id: int) -> Dict[str, Any]:
                 attempt, max_attempts, payload.get("cmd")
             )
             if attempt < max_attempts:
-                await asyncio.sleep(1.5 * attempt)
+                await asyncio.sleep(_gas_retry_delay(attempt))
                 continue
             raise RuntimeError("GAS не ответил за 30 сек (3 попытки)")
 
@@ -414,21 +505,141 @@ async def gas_request(payload: Dict[str, Any], user_id: int) -> Dict[str, Any]:
                 e, attempt, max_attempts, payload.get("cmd")
             )
             if attempt < max_attempts:
-                await asyncio.sleep(1.5 * attempt)
+                await asyncio.sleep(_gas_retry_delay(attempt))
                 continue
             raise RuntimeError(f"Сетевая ошибка GAS: {e}")
 
+        # 5xx и 429 — повторяем
+        if status >= 500 or status == 429:
+            last_error = f"HTTP {status}"
+            logger.warning(
+                "GAS attempt %d/%d failed: %s (cmd=%s)",
+                attempt, max_attempts, last_error, payload.get("cmd")
+            )
+            if attempt < max_attempts:
+                await asyncio.sleep(_gas_retry_delay(attempt, retry_after))
+                continue
+            raise RuntimeError(f"GAS вернул {last_error} после {max_attempts} попыток")
+
+        # 4xx — не повторяем, что-то не так с запросом
+        if status >= 400:
+            logger.error("GAS HTTP %d (cmd=%s): %r", status, payload.get("cmd"), raw[:500])
+            raise RuntimeError(f"GAS HTTP {status}")
+
+        try:
+            data = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            logger.error("GAS non-json response (cmd=%s): %r", payload.get("cmd"), raw[:500])
+            raise RuntimeError("GAS вернул не-JSON ответ")
+
+        if not data.get("ok"):
+            # Бизнес-ошибка GAS — не ретраим
+            raise RuntimeError(data.get("error") or "GAS error")
+
+        if attempt > 1:
+            logger.info("GAS recovered on attempt %d (cmd=%s)", attempt, payload.get("cmd"))
+        if payload.get("cmd") in _GAS_WRITE_CMDS:
+            gas_cache_invalidate()
+        return data["data"]
+
     # Сюда не должны добираться, но на всякий
     raise RuntimeError(last_error or "Unknown GAS error")
 
 
+# ========================================
+# GAS КЭШ (короткий TTL для команд чтения)
+# ========================================
+# Категории меняются редко; после правки в таблице их можно сбросить командой /reload_cats
+GAS_TTL_CATEGORIES  = 300
+GAS_TTL_MAIN_SCREEN = 5
+# Сколько живёт предзагрузка анализа: выбор периода и разреза — пара нажатий
+GAS_TTL_ANALYSIS_PREFETCH = 15
+
+# Команды, меняющие данные: после них кэш чтения сбрасывается
+_GAS_WRITE_CMDS = frozenset({"add", "set_balance", "add_debtor", "update_debtor", "delete_debtor"})
+# Команды, чьи ответы записи не затрагивают
+_GAS_STATIC_CMDS = frozenset({"get_categories"})
+
+_GasCacheKey = Tuple[int, str, frozenset]
+
+_gas_cache: Dict[_GasCacheKey, Tuple[float, Any]] = {}
+_gas_cache_locks: Dict[_GasCacheKey, asyncio.Lock] = defaultdict(asyncio.Lock)
+_gas_cache_generation = 0
+
+
+def _gas_cache_key(payload: Dict[str, Any], user_id: int) -> _GasCacheKey:
+    return (user_id, payload["cmd"], frozenset(payload.items()))
+
+
+async def gas_cached(payload: Dict[str, Any], user_id: int, ttl: float) -> Dict[str, Any]:
+    """
+    gas_request с кэшем на ttl секунд (ключ — user_id + payload).
+    Параллельные промахи по одному ключу ждут один запрос, а не шлют свои.
+    """
+    key = _gas_cache_key(payload, user_id)
+    hit = _gas_cache.get(key)
+    if hit and time.monotonic() - hit[0] < ttl:
+        return hit[1]
+
+    async with _gas_cache_locks[key]:
+        hit = _gas_cache.get(key)
+        if hit and time.monotonic() - hit[0] < ttl:
+            return hit[1]
+        generation = _gas_cache_generation
+        data = await gas_request(payload, user_id)
+        # Если пока шёл запрос случилась запись — ответ мог устареть, не кладём его
+        if generation == _gas_cache_generation:
+            _gas_cache[key] = (time.monotonic(), data)
+        return data
+
+
+def gas_cache_put(payload: Dict[str, Any], user_id: int, data: Any):
+    """Кладёт в кэш уже известный ответ на payload (например, пришедший вместе с записью)."""
+    _gas_cache[_gas_cache_key(payload, user_id)] = (time.monotonic(), data)
+
+
+async def gas_write(payload: Dict[str, Any], user_id: int) -> Dict[str, Any]:
+    """
+    Команда записи. Заодно просим GAS вернуть свежий главный экран (поле main_screen):
+    если он пришёл, кладём его в кэш, и экран после сохранения рисуется без второго запроса.
+    GAS, который этого не умеет, лишнее поле просто игнорирует.
+    """
+    screen = main_screen_payload(user_id)
+    payload = dict(payload, main_screen={"view": screen["view"], "limit": screen["limit"]})
+    data = await gas_request(payload, user_id)
+    if isinstance(data, dict) and data.get("main_screen"):
+        gas_cache_put(screen, user_id, data["main_screen"])
+    return data
+
+
+def gas_cache_invalidate(include_static: bool = False):
+    """Сбрасывает кэш чтения (по умолчанию кроме категорий)."""
+    global _gas_cache_generation
+    _gas_cache_generation += 1
+    for key in list(_gas_cache):
+        if include_static or key[1] not in _GAS_STATIC_CMDS:
+            del _gas_cache[key]
+
+
 # ========================================
 # ФОРМАТИРОВАНИЕ ТРАНЗАКЦИЙ
 # ========================================
+_THOUSANDS_SEP_TABLE = str.maketrans(",", " ")
+
+
+def fmt_money(value: float, decimals: int = 2) -> str:
+    """Число с пробелом между разрядами: 1234567.5 -> '1 234 567.50'."""
+    return f"{value:,.{decimals}f}".translate(_THOUSANDS_SEP_TABLE)
+
+
+_TYPE_EMOJI = {"доход": "➕", "расход": "➖"}
+
+
 def format_transaction(tx: Dict) -> str:
-    type_emoji = "➕" if tx["type"] == "доход" else "➖"
-    amount_str = f"{tx['amount']:,.0f} ₽".replace(",", " ")
-    if tx["type"] == "доход":
+    tx_type    = tx["type"]
+    type_emoji = _TYPE_EMOJI.get(tx_type, "➖")
+    amount_str = f"{fmt_money(tx['amount'], 0)} ₽"
+    if tx_type == "доход":
         comment  = tx.get("comment", "")
         category = tx.get("category", "")
         return f"{type_emoji} {amount_str} — {comment} — {category}"
@@ -444,8 +655,27 @@ def format_transaction(tx: Dict) -> str:
 # ========================================
 # ГЛАВНЫЕ ЭКРАНЫ
 # ========================================
+_MAIN_SCREEN_OWNER = {"cmd": "get_main_screen", "view": "owner", "limit": 5}
+_MAIN_SCREEN_ADMIN = {"cmd": "get_main_screen", "view": "admin", "limit": 10}
+
+
+def main_screen_payload(user_id: int) -> Dict[str, Any]:
+    return _MAIN_SCREEN_OWNER if is_owner(user_id) else _MAIN_SCREEN_ADMIN
+
+
+def debtors_list_text(debt_type: str, debtors: Dict[str, Any]) -> str:
+    title = "💰 Долги перед Inside" if debt_type == "owe_me" else "💳 Долги Inside"
+    parts = [f"<b>{title}</b>\n\n"]
+    if debtors.get("debtors"):
+        parts.extend(f"• {d['name']}: <b>{fmt_money(d['amount'])}</b> ₽\n" for d in debtors["debtors"])
+        parts.append(f"\n━━━━━━━━━━━━━━━━\nВсего: <b>{fmt_money(debtors.get('total', 0))}</b> ₽")
+    else:
+        parts.append("Список пуст")
+    return "".join(parts)
+
+
 async def main_screen_text_owner(user_id: int) -> str:
-    s = await gas_request({"cmd": "get_main_screen", "view": "owner", "limit": 5}, user_id)
+    s = await gas_cached(_MAIN_SCREEN_OWNER, user_id, GAS_TTL_MAIN_SCREEN)
 
     month      = s.get("month_label", "Текущий месяц")
     exp        = s.get("expenses", 0)
@@ -467,56 +697,54 @@ async def main_screen_text_owner(user_id: int) -> str:
     bn_with_debts    = bn_balance   + owe_us_bn   - we_owe_bn
     total_with_debts = cash_with_debts + bn_with_debts
 
-    text = (
+    parts = [
         f"<b>💼 Бизнес</b>\n"
         f"<b>{month}</b>\n\n"
         f"<b>💰 Баланс:</b>\n"
-        f"💵 Наличные: <b>{cash_balance:,.2f}</b> ₽\n"
-        f"🏢 БН (QR и счёт): <b>{bn_balance:,.2f}</b> ₽\n"
+        f"💵 Наличные: <b>{fmt_money(cash_balance)}</b> ₽\n"
+        f"🏢 БН (QR и счёт): <b>{fmt_money(bn_balance)}</b> ₽\n"
         f"━━━━━━━━━━━━━━━━\n"
-        f"💵 Всего: <b>{bal_total:,.2f}</b> ₽\n\n"
+        f"💵 Всего: <b>{fmt_money(bal_total)}</b> ₽\n\n"
         f"<b>💰 Баланс с учётом долгов:</b>\n"
-        f"💵 Наличные: <b>{cash_with_debts:,.2f}</b> ₽\n"
-        f"🏢 БН (QR и счёт): <b>{bn_with_debts:,.2f}</b> ₽\n"
+        f"💵 Наличные: <b>{fmt_money(cash_with_debts)}</b> ₽\n"
+        f"🏢 БН (QR и счёт): <b>{fmt_money(bn_with_debts)}</b> ₽\n"
         f"━━━━━━━━━━━━━━━━\n"
-        f"💵 Всего: <b>{total_with_debts:,.2f}</b> ₽\n\n"
-        f"➖ Расходы: <b>{exp:,.2f}</b> ₽\n"
-        f"➕ Доходы: <b>{inc:,.2f}</b> ₽\n"
-        f"🟰 За месяц: <b>{bal_month:,.2f}</b> ₽\n"
-    ).replace(",", " ")
+        f"💵 Всего: <b>{fmt_money(total_with_debts)}</b> ₽\n\n"
+        f"➖ Расходы: <b>{fmt_money(exp)}</b> ₽\n"
+        f"➕ Доходы: <b>{fmt_money(inc)}</b> ₽\n"
+        f"🟰 За месяц: <b>{fmt_money(bal_month)}</b> ₽\n"
+    ]
 
     transactions = s.get("transactions", [])
     if transactions:
-        text += "\n<b>📋 Последние 5 операций:</b>\n\n"
-        for tx in transactions[:5]:
-            text += format_transaction(tx) + "\n"
+        parts.append("\n<b>📋 Последние 5 операций:</b>\n\n")
+        parts.extend(format_transaction(tx) + "\n" for tx in transactions[:5])
 
-    return text
+    return "".join(parts)
 
 
 async def main_screen_text_admin(user_id: int) -> str:
-    s = await gas_request({"cmd": "get_main_screen", "view": "admin", "limit": 10}, user_id)
+    s = await gas_cached(_MAIN_SCREEN_ADMIN, user_id, GAS_TTL_MAIN_SCREEN)
 
     month        = s.get("month_label", "Текущий месяц")
     month_income = s.get("month_income", 0)
     checks_count = s.get("checks_count", 0)
 
-    text = (
+    parts = [
         f"<b>💼 Касса детейлинг-студии</b>\n"
         f"<b>{month}</b>\n\n"
         f"🧾 Чеков за месяц: <b>{checks_count}</b>\n"
-        f"➕ Оборот: <b>{month_income:,.2f}</b> ₽\n"
-    ).replace(",", " ")
+        f"➕ Оборот: <b>{fmt_money(month_income)}</b> ₽\n"
+    ]
 
     transactions = s.get("transactions", [])
     if transactions:
-        text += "\n<b>📋 Последние 10 твоих операций:</b>\n\n"
-        for tx in transactions[:10]:
-            text += format_transaction(tx) + "\n"
+        parts.append("\n<b>📋 Последние 10 твоих операций:</b>\n\n")
+        parts.extend(format_transaction(tx) + "\n" for tx in transactions[:10])
     else:
-        text += "\nПока нет операций"
+        parts.append("\nПока нет операций")
 
-    return text
+    return "".join(parts)
 
 
 async def get_main_screen(user_id: int):
@@ -530,8 +758,51 @@ async def get_main_screen(user_id: int):
     return txt, kb
 
 
+async def fetch_main_screen(user_id: int) -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+    """Главный экран для показа после действия; если GAS не ответил — None, а не исключение."""
+    try:
+        return await get_main_screen(user_id)
+    except Exception as e:
+        logger.warning("Main screen fetch failed (user=%s): %s", user_id, e)
+        return None
+
+
+async def send_main_screen(update: Update, user_id: int, prefix: str = ""):
+    """
+    Отправляет главный экран; prefix (результат действия, HTML) — в том же сообщении.
+    Результат действия отправляется и тогда, когда экран получить не удалось:
+    иначе пользователь не узнает, что запись прошла, и внесёт её повторно.
+    """
+    if prefix:
+        screen = await fetch_main_screen(user_id)
+    else:
+        # Кроме экрана показывать нечего — ошибку отдаём error_handler
+        screen = await get_main_screen(user_id)
+    await send_with_screen(update, prefix, screen)
+
+
+async def send_with_screen(update: Update, prefix: str, screen: Optional[Tuple[str, InlineKeyboardMarkup]]):
+    """
+    prefix и главный экран одним сообщением, если вместе влезают в лимит Telegram.
+    screen=None (экран не получен) — уходит только prefix.
+    """
+    chat = update.effective_chat
+    if screen is None:
+        await chat.send_message(prefix, parse_mode=ParseMode.HTML)
+        return
+
+    txt, kb = screen
+    if prefix:
+        combined = f"{prefix}\n\n{txt}"
+        if len(combined) <= TG_MESSAGE_LIMIT:
+            txt = combined
+        else:
+            await chat.send_message(prefix, parse_mode=ParseMode.HTML)
+    await chat.send_message(txt, reply_markup=kb, parse_mode=ParseMode.HTML)
+
+
 async def get_categories(user_id: int) -> Dict[str, Any]:
-    return await gas_request({"cmd": "get_categories"}, user_id)
+    return await gas_cached({"cmd": "get_categories"}, user_id, GAS_TTL_CATEGORIES)
 
 
 # ========================================
@@ -543,184 +814,209 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     context.user_data.clear()
-    user_id = update.effective_user.id
-    txt, kb = await get_main_screen(user_id)
-    await update.message.reply_text(txt, reply_markup=kb, parse_mode=ParseMode.HTML)
+    await send_main_screen(update, update.effective_user.id)
     return ST_MENU
 
 
-async def on_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_allowed(update):
-        await update.callback_query.answer()
-        await update.callback_query.edit_message_text(DENY_TEXT)
-        return ConversationHandler.END
+async def _menu_add(update: Update, context: ContextTypes.DEFAULT_TYPE, q: CallbackQuery, user_id: int):
+    await q.edit_message_text("Окей 🙂 Что вносим?", reply_markup=kb_choose_type())
+    context.user_data["working_message_id"] = q.message.message_id
+    return ST_ADD_CHOOSE_TYPE
 
-    q       = update.callback_query
-    await q.answer()
-    user_id = update.effective_user.id
-    role    = get_role(user_id)
 
-    if q.data == "menu:add":
-        await q.edit_message_text("Окей 🙂 Что вносим?", reply_markup=kb_choose_type())
-        context.user_data["working_message_id"] = q.message.message_id
-        return ST_ADD_CHOOSE_TYPE
+async def _menu_film(update: Update, context: ContextTypes.DEFAULT_TYPE, q: CallbackQuery, user_id: int):
+    context.user_data["film"] = {}
+    await q.edit_message_text("📦 Продал пленку\n\nКому продали? Напиши имя клиента:")
+    context.user_data["working_message_id"] = q.message.message_id
+    return ST_FILM_CLIENT
 
-    if q.data == "menu:film":
-        context.user_data.pop("film", None)
-        context.user_data["film"] = {}
-        await q.edit_message_text("📦 Продал пленку\n\nКому продали? Напиши имя клиента:")
-        context.user_data["working_message_id"] = q.message.message_id
-        return ST_FILM_CLIENT
 
-    if q.data == "menu:analysis":
-        if not is_owner(user_id):
-            await q.answer("Доступ запрещён", show_alert=True)
-            return ST_MENU
-        await q.edit_message_text("📊 Анализ\n\nВыбери период:", reply_markup=kb_analysis_periods())
-        context.user_data["working_message_id"] = q.message.message_id
-        return ST_ANALYSIS_PERIOD
+async def _menu_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE, q: CallbackQuery, user_id: int):
+    if not is_owner(user_id):
+        await q.answer("Доступ запрещён", show_alert=True)
+        return ST_MENU
+    await q.edit_message_text("📊 Анализ\n\nВыбери период:", reply_markup=kb_analysis_periods())
+    context.user_data["working_message_id"] = q.message.message_id
+    # Пока пользователь выбирает период, заранее тянем самый частый — месяц
+    start_analysis_prefetch(context, user_id, "month")
+    return ST_ANALYSIS_PERIOD
 
-    if q.data == "menu:balance":
-        if not is_owner(user_id):
-            await q.answer("Доступ запрещён", show_alert=True)
-            return ST_MENU
-        balances = await gas_request({"cmd": "get_all_balances"}, user_id)
-        text = (
-            f"<b>⚙️ Корректировать баланс</b>\n\n"
-            f"Текущие значения:\n"
-            f"💵 Наличные: <b>{balances.get('cash', 0):,.2f}</b> ₽\n"
-            f"🏢 БН (QR и счёт): <b>{balances.get('bn', 0):,.2f}</b> ₽\n\n"
-            f"Установи новое базовое значение баланса.\n"
-            f"Все последующие транзакции будут изменять его."
-        ).replace(",", " ")
-        await q.edit_message_text(text, reply_markup=kb_balance_menu(), parse_mode=ParseMode.HTML)
-        context.user_data["working_message_id"] = q.message.message_id
+
+async def _menu_balance(update: Update, context: ContextTypes.DEFAULT_TYPE, q: CallbackQuery, user_id: int):
+    if not is_owner(user_id):
+        await q.answer("Доступ запрещён", show_alert=True)
         return ST_MENU
+    balances = await gas_request({"cmd": "get_all_balances"}, user_id)
+    text = (
+        f"<b>⚙️ Корректировать баланс</b>\n\n"
+        f"Текущие значения:\n"
+        f"💵 Наличные: <b>{fmt_money(balances.get('cash', 0))}</b> ₽\n"
+        f"🏢 БН (QR и счёт): <b>{fmt_money(balances.get('bn', 0))}</b> ₽\n\n"
+        f"Установи новое базовое значение баланса.\n"
+        f"Все последующие транзакции будут изменять его."
+    )
+    await q.edit_message_text(text, reply_markup=kb_balance_menu(), parse_mode=ParseMode.HTML)
+    context.user_data["working_message_id"] = q.message.message_id
+    return ST_MENU
 
-    if q.data == "menu:debts_owe_us":
-        debt_type = "owe_me"
-        context.user_data["debt_type"] = debt_type
-        debtors = await gas_request({"cmd": "get_debtors_list", "debt_type": debt_type}, user_id)
 
-        text = "<b>💰 Долги перед Inside</b>\n\n"
-        if debtors.get("debtors"):
-            for d in debtors["debtors"]:
-                text += f"• {d['name']}: <b>{d['amount']:,.2f}</b> ₽\n"
-            text += f"\n━━━━━━━━━━━━━━━━\nВсего: <b>{debtors.get('total', 0):,.2f}</b> ₽"
-        else:
-            text += "Список пуст"
-        text = text.replace(",", " ")
+async def _menu_debts_owe_us(update: Update, context: ContextTypes.DEFAULT_TYPE, q: CallbackQuery, user_id: int):
+    debt_type = "owe_me"
+    context.user_data["debt_type"] = debt_type
+    debtors = await gas_request({"cmd": "get_debtors_list", "debt_type": debt_type}, user_id)
 
-        owner_mode = is_owner(user_id)
-        await q.edit_message_text(
-            text,
-            reply_markup=kb_debtors_list(debtors.get("debtors", []), owner_mode),
-            parse_mode=ParseMode.HTML
-        )
-        context.user_data["working_message_id"] = q.message.message_id
-        return ST_DEBTS_SELECT
+    text = debtors_list_text("owe_me", debtors)
 
-    if q.data == "menu:debts_we_owe":
-        if not is_owner(user_id):
-            await q.answer("Доступ запрещён", show_alert=True)
-            return ST_MENU
-        debt_type = "i_owe"
-        context.user_data["debt_type"] = debt_type
-        debtors = await gas_request({"cmd": "get_debtors_list", "debt_type": debt_type}, user_id)
-
-        text = "<b>💳 Долги Inside</b>\n\n"
-        if debtors.get("debtors"):
-            for d in debtors["debtors"]:
-                text += f"• {d['name']}: <b>{d['amount']:,.2f}</b> ₽\n"
-            text += f"\n━━━━━━━━━━━━━━━━\nВсего: <b>{debtors.get('total', 0):,.2f}</b> ₽"
-        else:
-            text += "Список пуст"
-        text = text.replace(",", " ")
+    owner_mode = is_owner(user_id)
+    await q.edit_message_text(
+        text,
+        reply_markup=kb_debtors_list(debtors.get("debtors", []), owner_mode),
+        parse_mode=ParseMode.HTML
+    )
+    context.user_data["working_message_id"] = q.message.message_id
+    return ST_DEBTS_SELECT
 
-        await q.edit_message_text(
-            text,
-            reply_markup=kb_debtors_list(debtors.get("debtors", []), True),
-            parse_mode=ParseMode.HTML
-        )
-        context.user_data["working_message_id"] = q.message.message_id
-        return ST_DEBTS_SELECT
 
-    return ST_MENU
+async def _menu_debts_we_owe(update: Update, context: ContextTypes.DEFAULT_TYPE, q: CallbackQuery, user_id: int):
+    if not is_owner(user_id):
+        await q.answer("Доступ запрещён", show_alert=True)
+        return ST_MENU
+    debt_type = "i_owe"
+    context.user_data["debt_type"] = debt_type
+    debtors = await gas_request({"cmd": "get_debtors_list", "debt_type": debt_type}, user_id)
+
+    text = debtors_list_text("i_owe", debtors)
+
+    await q.edit_message_text(
+        text,
+        reply_markup=kb_debtors_list(debtors.get("debtors", []), True),
+        parse_mode=ParseMode.HTML
+    )
+    context.user_data["working_message_id"] = q.message.message_id
+    return ST_DEBTS_SELECT
+
+
+# callback_data -> обработчик (update, context, q, user_id), возвращающий следующее состояние
+MENU_ROUTES: Dict[str, Callable[..., Awaitable[int]]] = {
+    "menu:add":          _menu_add,
+    "menu:film":         _menu_film,
+    "menu:analysis":     _menu_analysis,
+    "menu:balance":      _menu_balance,
+    "menu:debts_owe_us": _menu_debts_owe_us,
+    "menu:debts_we_owe": _menu_debts_we_owe,
+}
+
+
+async def on_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_allowed(update):
+        await update.callback_query.answer()
+        await update.callback_query.edit_message_text(DENY_TEXT)
+        return ConversationHandler.END
+
+    q       = update.callback_query
+    await q.answer()
+    route   = MENU_ROUTES.get(q.data)
+    if route is None:
+        return ST_MENU
+    return await route(update, context, q, update.effective_user.id)
 
 
 # ========================================
 # BACK ROUTER
 # ========================================
-async def back_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    q       = update.callback_query
-    await q.answer()
-    user_id = update.effective_user.id
+async def _back_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q: CallbackQuery, user_id: int):
+    cancel_analysis_prefetch(context)
+    delete_working_message(context, update.effective_chat.id)
+    await send_main_screen(update, user_id)
+    return ST_MENU
 
-    if q.data == "back:menu":
-        await delete_working_message(context, update.effective_chat.id)
-        txt, kb = await get_main_screen(user_id)
-        await update.effective_chat.send_message(txt, reply_markup=kb, parse_mode=ParseMode.HTML)
-        return ST_MENU
 
-    if q.data == "back:choose_type":
-        await q.edit_message_text("Окей 🙂 Что вносим?", reply_markup=kb_choose_type())
-        return ST_ADD_CHOOSE_TYPE
+async def _back_choose_type(update: Update, context: ContextTypes.DEFAULT_TYPE, q: CallbackQuery, user_id: int):
+    await q.edit_message_text("Окей 🙂 Что вносим?", reply_markup=kb_choose_type())
+    return ST_ADD_CHOOSE_TYPE
 
-    if q.data == "back:exp_cat":
-        categories = await get_categories(user_id)
-        await q.edit_message_text(
-            "На что потратили? 💪",
-            reply_markup=kb_expense_categories(categories["expenses"])
-        )
-        return ST_EXP_CATEGORY
 
-    if q.data == "back:analysis_periods":
-        await q.edit_message_text("📊 Анализ\n\nВыбери период:", reply_markup=kb_analysis_periods())
-        return ST_ANALYSIS_PERIOD
+async def _back_exp_cat(update: Update, context: ContextTypes.DEFAULT_TYPE, q: CallbackQuery, user_id: int):
+    categories = await get_categories(user_id)
+    await q.edit_message_text(
+        "На что потратили? 💪",
+        reply_markup=kb_expense_categories(categories["expenses"])
+    )
+    return ST_EXP_CATEGORY
 
-    if q.data == "back:analysis_type":
-        period_labels = {"today": "Сегодня", "week": "Эта неделя", "month": "Этот месяц", "year": "Этот год"}
-        period       = context.user_data.get("analysis_period", "month")
-        period_label = period_labels.get(period, period)
-        await q.edit_message_text(f"📊 {period_label}\n\nЧто посмотрим?", reply_markup=kb_analysis_type())
-        return ST_ANALYSIS_TYPE
 
-    if q.data == "back:debtors_list":
-        debt_type = context.user_data.get("debt_type", "owe_me")
-        debtors   = await gas_request({"cmd": "get_debtors_list", "debt_type": debt_type}, user_id)
+async def _back_analysis_periods(update: Update, context: ContextTypes.DEFAULT_TYPE, q: CallbackQuery, user_id: int):
+    await q.edit_message_text("📊 Анализ\n\nВыбери период:", reply_markup=kb_analysis_periods())
+    return ST_ANALYSIS_PERIOD
 
-        if debt_type == "owe_me":
-            text = "<b>💰 Долги перед Inside</b>\n\n"
-        else:
-            text = "<b>💳 Долги Inside</b>\n\n"
 
-        if debtors.get("debtors"):
-            for d in debtors["debtors"]:
-                text += f"• {d['name']}: <b>{d['amount']:,.2f}</b> ₽\n"
-            text += f"\n━━━━━━━━━━━━━━━━\nВсего: <b>{debtors.get('total', 0):,.2f}</b> ₽"
-        else:
-            text += "Список пуст"
-        text = text.replace(",", " ")
+async def _back_analysis_type(update: Update, context: ContextTypes.DEFAULT_TYPE, q: CallbackQuery, user_id: int):
+    period_labels = {"today": "Сегодня", "week": "Эта неделя", "month": "Этот месяц", "year": "Этот год"}
+    period       = context.user_data.get("analysis_period", "month")
+    period_label = period_labels.get(period, period)
+    await q.edit_message_text(f"📊 {period_label}\n\nЧто посмотрим?", reply_markup=kb_analysis_type())
+    return ST_ANALYSIS_TYPE
 
-        owner_mode = is_owner(user_id)
-        await q.edit_message_text(
-            text,
-            reply_markup=kb_debtors_list(debtors.get("debtors", []), owner_mode),
-            parse_mode=ParseMode.HTML
-        )
-        return ST_DEBTS_SELECT
 
-    return ST_MENU
+async def _back_debtors_list(update: Update, context: ContextTypes.DEFAULT_TYPE, q: CallbackQuery, user_id: int):
+    debt_type = context.user_data.get("debt_type", "owe_me")
+    debtors   = await gas_request({"cmd": "get_debtors_list", "debt_type": debt_type}, user_id)
+
+    text = debtors_list_text(debt_type, debtors)
+
+    owner_mode = is_owner(user_id)
+    await q.edit_message_text(
+        text,
+        reply_markup=kb_debtors_list(debtors.get("debtors", []), owner_mode),
+        parse_mode=ParseMode.HTML
+    )
+    return ST_DEBTS_SELECT
+
+
+BACK_ROUTES: Dict[str, Callable[..., Awaitable[int]]] = {
+    "back:menu":             _back_menu,
+    "back:choose_type":      _back_choose_type,
+    "back:exp_cat":          _back_exp_cat,
+    "back:analysis_periods": _back_analysis_periods,
+    "back:analysis_type":    _back_analysis_type,
+    "back:debtors_list":     _back_debtors_list,
+}
+
+
+async def back_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q       = update.callback_query
+    await q.answer()
+    route   = BACK_ROUTES.get(q.data)
+    if route is None:
+        return ST_MENU
+    return await route(update, context, q, update.effective_user.id)
 
 
 # ========================================
 # ТРАНЗАКЦИИ
 # ========================================
+@dataclass(slots=True)
+class Tx:
+    """Транзакция, которую пользователь вносит по шагам (живёт в user_data["tx"])."""
+    type:         str   = ""
+    category:     str   = ""
+    amount:       float = 0.0
+    payment_type: str   = ""
+    comment:      str   = ""
+
+
+def current_tx(context: ContextTypes.DEFAULT_TYPE) -> Tx:
+    tx = context.user_data.get("tx")
+    if tx is None:
+        tx = context.user_data["tx"] = Tx()
+    return tx
+
+
 async def choose_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     user_id = update.effective_user.id
-    context.user_data["tx"] = {}
+    context.user_data["tx"] = Tx()
     categories = await get_categories(user_id)
 
     if q.data == "type:expense":
@@ -740,12 +1036,11 @@ async def expense_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     categories = context.user_data.get("categories", {}).get("expenses", [])
-    idx = int(q.data.split(":")[1])
+    idx = int(q.data.partition(":")[2])
     cat = categories[idx]
-    tx  = context.user_data.get("tx", {})
-    tx["type"]     = "расход"
-    tx["category"] = cat
-    context.user_data["tx"] = tx
+    tx  = current_tx(context)
+    tx.type     = "расход"
+    tx.category = cat
     prompt = "Сколько?\n\nПримеры: <code>2500</code>, <code>2 500</code>, <code>2.500</code>, <code>2500,50</code>, <code>2к</code>"
     await q.edit_message_text(prompt, parse_mode=ParseMode.HTML)
     return ST_AMOUNT
@@ -755,13 +1050,12 @@ async def income_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     categories = context.user_data.get("categories", {}).get("incomes", [])
-    idx = int(q.data.split(":")[1])
+    idx = int(q.data.partition(":")[2])
     cat = categories[idx]
-    tx  = context.user_data.get("tx", {})
-    tx["type"]         = "доход"
-    tx["category"]     = cat
-    tx["payment_type"] = cat
-    context.user_data["tx"] = tx
+    tx  = current_tx(context)
+    tx.type         = "доход"
+    tx.category     = cat
+    tx.payment_type = cat
     prompt = "Сколько?\n\nПримеры: <code>2500</code>, <code>2 500</code>, <code>2.500</code>, <code>2500,50</code>, <code>2к</code>"
     await q.edit_message_text(prompt, parse_mode=ParseMode.HTML)
     return ST_AMOUNT
@@ -773,26 +1067,22 @@ async def amount_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     amt = parse_amount(update.message.text)
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    delete_user_message(update, context)
 
     if amt is None:
-        await delete_working_message(context, update.effective_chat.id)
+        delete_working_message(context, update.effective_chat.id)
         msg = await update.effective_chat.send_message(
             "Не понял сумму 🙈\nНапиши, пожалуйста, например: 2500 / 2 500 / 2500,50 / 2к"
         )
         context.user_data["working_message_id"] = msg.message_id
         return ST_AMOUNT
 
-    tx = context.user_data.get("tx", {})
-    tx["amount"] = amt
-    context.user_data["tx"] = tx
+    tx = current_tx(context)
+    tx.amount = amt
 
     work_msg_id = context.user_data.get("working_message_id")
 
-    if tx.get("type") == "расход":
+    if tx.type == "расход":
         categories    = context.user_data.get("categories", {})
         payment_types = categories.get("payment_types", [])
         if work_msg_id:
@@ -824,11 +1114,9 @@ async def payment_type_selected(update: Update, context: ContextTypes.DEFAULT_TY
     await q.answer()
     categories    = context.user_data.get("categories", {})
     payment_types = categories.get("payment_types", [])
-    idx           = int(q.data.split(":")[1])
+    idx           = int(q.data.partition(":")[2])
     payment_type  = payment_types[idx]
-    tx = context.user_data.get("tx", {})
-    tx["payment_type"] = payment_type
-    context.user_data["tx"] = tx
+    current_tx(context).payment_type = payment_type
     await q.edit_message_text("Добавишь коммент?", reply_markup=kb_skip_comment())
     return ST_COMMENT
 
@@ -836,9 +1124,7 @@ async def payment_type_selected(update: Update, context: ContextTypes.DEFAULT_TY
 async def comment_skip(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    tx = context.user_data.get("tx", {})
-    tx["comment"] = ""
-    context.user_data["tx"] = tx
+    current_tx(context).comment = ""
     await save_and_finish_(update, context)
     return ST_MENU
 
@@ -848,64 +1134,46 @@ async def comment_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(DENY_TEXT)
         return ConversationHandler.END
 
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    delete_user_message(update, context)
 
-    tx           = context.user_data.get("tx", {})
+    tx           = current_tx(context)
     comment_text = (update.message.text or "").strip()
 
-    if tx.get("type") == "доход" and not comment_text:
-        await delete_working_message(context, update.effective_chat.id)
+    if tx.type == "доход" and not comment_text:
+        delete_working_message(context, update.effective_chat.id)
         msg = await update.effective_chat.send_message("ФИО или марка авто обязательны! Напиши:")
         context.user_data["working_message_id"] = msg.message_id
         return ST_COMMENT
 
-    tx["comment"] = comment_text
-    context.user_data["tx"] = tx
+    tx.comment = comment_text
     await save_and_finish_(update, context)
     return ST_MENU
 
 
 async def save_and_finish_(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await delete_working_message(context, update.effective_chat.id)
+    delete_working_message(context, update.effective_chat.id)
     user_id = update.effective_user.id
-    tx      = context.user_data.get("tx", {})
-
-    payload = {
-        "cmd":          "add",
-        "type":         tx.get("type"),
-        "category":     tx.get("category"),
-        "amount":       tx.get("amount"),
-        "payment_type": tx.get("payment_type"),
-        "comment":      tx.get("comment", "")
-    }
+    tx      = current_tx(context)
+    payload = {"cmd": "add", **asdict(tx)}
 
     try:
-        await gas_request(payload, user_id)
+        await gas_write(payload, user_id)
     except Exception as e:
-        await update.effective_chat.send_message(f"Ошибка: {e}")
-        txt, kb = await get_main_screen(user_id)
-        await update.effective_chat.send_message(txt, reply_markup=kb, parse_mode=ParseMode.HTML)
+        await send_main_screen(update, user_id, f"Ошибка: {html.escape(str(e))}")
         return
 
-    if tx.get("type") == "расход":
-        header       = random.choice(PH_SAVED_EXPENSE)
-        payment_type = tx.get("payment_type", "")
-        detail       = f"{tx.get('category')} — {tx.get('amount'):,.2f} ₽ — {payment_type}".replace(",", " ")
+    if tx.type == "расход":
+        header = next(_PH_SAVED_EXPENSE_CYCLE)
+        detail = f"{tx.category} — {fmt_money(tx.amount)} ₽ — {tx.payment_type}"
     else:
-        header = random.choice(PH_SAVED_INCOME)
-        detail = f"{tx.get('category')} — {tx.get('amount'):,.2f} ₽".replace(",", " ")
+        header = next(_PH_SAVED_INCOME_CYCLE)
+        detail = f"{tx.category} — {fmt_money(tx.amount)} ₽"
 
-    comment = tx.get("comment", "").strip()
+    comment = tx.comment.strip()
     if comment:
         detail += f"\n{comment}"
 
-    await update.effective_chat.send_message(f"{header}\n{detail}")
-
-    txt, kb = await get_main_screen(user_id)
-    await update.effective_chat.send_message(txt, reply_markup=kb, parse_mode=ParseMode.HTML)
+    await send_main_screen(update, user_id, f"{header}\n{html.escape(detail)}")
 
 
 # ========================================
@@ -916,17 +1184,86 @@ async def analysis_period(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
 
     if q.data == "aperiod:special":
+        cancel_analysis_prefetch(context)
         await q.edit_message_text("⚙️ Специальные отчеты", reply_markup=kb_special_reports())
         return ST_SPECIAL_REPORTS
 
-    period = q.data.split(":")[1]
+    period = q.data.partition(":")[2]
     context.user_data["analysis_period"] = period
+    # Пока выбирают разрез, тянем данные за выбранный период, если GAS ничем не занят
+    start_analysis_prefetch(context, update.effective_user.id, period)
     period_labels = {"today": "Сегодня", "week": "Эта неделя", "month": "Этот месяц", "year": "Этот год"}
     period_label  = period_labels.get(period, period)
     await q.edit_message_text(f"📊 {period_label}\n\nЧто посмотрим?", reply_markup=kb_analysis_type())
     return ST_ANALYSIS_TYPE
 
 
+async def _prefetch_analysis(user_id: int, period: str) -> Optional[Dict[str, Any]]:
+    """
+    Затраты за период — самый частый разрез, тянем только его: один запрос к GAS.
+    При ошибке — None (запросим как обычно).
+    """
+    try:
+        return await gas_request({"cmd": "analysis_expense", "period": period}, user_id)
+    except Exception as e:
+        logger.warning("Analysis prefetch failed (period=%s): %s", period, e)
+        return None
+
+
+@dataclass(slots=True)
+class AnalysisPrefetch:
+    """Предзагрузка затрат за период (живёт в user_data["analysis_prefetch"])."""
+    period:     str
+    started:    float
+    generation: int
+    task:       "asyncio.Task[Optional[Dict[str, Any]]]"
+
+    def fresh(self) -> bool:
+        # Не старше TTL и с тех пор ничего не записывали
+        return (
+            time.monotonic() - self.started <= GAS_TTL_ANALYSIS_PREFETCH
+            and self.generation == _gas_cache_generation
+        )
+
+
+def start_analysis_prefetch(context: ContextTypes.DEFAULT_TYPE, user_id: int, period: str):
+    """
+    Запускает предзагрузку за период. Пока прошлая ещё в полёте, новую не шлём:
+    отмена задачи не отменяет запрос, который GAS уже принял.
+    """
+    prefetch = context.user_data.get("analysis_prefetch")
+    if prefetch is not None:
+        if not prefetch.task.done():
+            return
+        if prefetch.period == period and prefetch.fresh():
+            return
+    context.user_data["analysis_prefetch"] = AnalysisPrefetch(
+        period=period,
+        started=time.monotonic(),
+        generation=_gas_cache_generation,
+        task=context.application.create_task(_prefetch_analysis(user_id, period)),
+    )
+
+
+def cancel_analysis_prefetch(context: ContextTypes.DEFAULT_TYPE):
+    prefetch = context.user_data.pop("analysis_prefetch", None)
+    if prefetch is not None:
+        prefetch.task.cancel()
+
+
+async def get_analysis(context: ContextTypes.DEFAULT_TYPE, user_id: int, period: str, atype: str) -> Dict[str, Any]:
+    """Данные анализа: из свежей предзагрузки затрат за тот же период, иначе запросом в GAS."""
+    prefetch = context.user_data.pop("analysis_prefetch", None)
+    if prefetch is not None:
+        if prefetch.period == period and atype == "expense" and prefetch.fresh():
+            data = await prefetch.task
+            if data is not None:
+                return data
+        else:
+            prefetch.task.cancel()
+    return await gas_request({"cmd": f"analysis_{atype}", "period": period}, user_id)
+
+
 async def analysis_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q       = update.callback_query
     await q.answer()
@@ -937,42 +1274,44 @@ async def analysis_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ST_MENU
 
     period       = context.user_data.get("analysis_period", "month")
-    atype        = q.data.split(":")[1]
+    atype        = q.data.partition(":")[2]
     period_labels = {"today": "Сегодня", "week": "Эта неделя", "month": "Этот месяц", "year": "Этот год"}
     period_label  = period_labels.get(period, period)
 
-    await delete_working_message(context, update.effective_chat.id)
+    delete_working_message(context, update.effective_chat.id)
 
     if atype == "income":
-        res    = await gas_request({"cmd": "analysis_income", "period": period}, user_id)
+        res, screen = await asyncio.gather(
+            get_analysis(context, user_id, period, "income"),
+            fetch_main_screen(user_id),
+        )
         total  = res.get("total", 0)
         by_type = res.get("by_type", {})
-        text   = f"<b>💰 Поступления за {period_label.lower()}</b>\n\n"
+        parts  = [f"<b>💰 Поступления за {period_label.lower()}</b>\n\n"]
         if total > 0:
             for ptype, amount in by_type.items():
                 percentage = (amount / total) * 100
                 emoji = "💵" if ptype == "Наличные" else "🏢"
-                text += f"{emoji} {ptype}: <b>{amount:,.0f}</b> ₽ ({percentage:.0f}%)\n"
-            text += f"━━━━━━━━━━━━━━━━\nИтого: <b>{total:,.0f}</b> ₽"
+                parts.append(f"{emoji} {ptype}: <b>{fmt_money(amount, 0)}</b> ₽ ({percentage:.0f}%)\n")
+            parts.append(f"━━━━━━━━━━━━━━━━\nИтого: <b>{fmt_money(total, 0)}</b> ₽")
         else:
-            text += "Нет данных"
-        text = text.replace(",", " ")
+            parts.append("Нет данных")
     else:
-        res         = await gas_request({"cmd": "analysis_expense", "period": period}, user_id)
+        res, screen = await asyncio.gather(
+            get_analysis(context, user_id, period, "expense"),
+            fetch_main_screen(user_id),
+        )
         total       = res.get("total", 0)
         by_category = res.get("by_category", {})
-        text        = f"<b>💸 Затраты за {period_label.lower()}</b>\n\n"
+        parts       = [f"<b>💸 Затраты за {period_label.lower()}</b>\n\n"]
         if total > 0:
             for cat, amount in by_category.items():
-                text += f"{cat}: <b>{amount:,.0f}</b> ₽\n"
-            text += f"━━━━━━━━━━━━━━━━\nИтого: <b>{total:,.0f}</b> ₽"
+                parts.append(f"{cat}: <b>{fmt_money(amount, 0)}</b> ₽\n")
+            parts.append(f"━━━━━━━━━━━━━━━━\nИтого: <b>{fmt_money(total, 0)}</b> ₽")
         else:
-            text += "Нет данных"
-        text = text.replace(",", " ")
+            parts.append("Нет данных")
 
-    await update.effective_chat.send_message(text, parse_mode=ParseMode.HTML)
-    txt, kb = await get_main_screen(user_id)
-    await update.effective_chat.send_message(txt, reply_markup=kb, parse_mode=ParseMode.HTML)
+    await send_with_screen(update, "".join(parts), screen)
     return ST_MENU
 
 
@@ -985,66 +1324,63 @@ async def special_reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.answer("Доступ запрещён", show_alert=True)
         return ST_MENU
 
-    await delete_working_message(context, update.effective_chat.id)
+    cancel_analysis_prefetch(context)
+    delete_working_message(context, update.effective_chat.id)
 
     if q.data == "special:compare":
-        res    = await gas_request({"cmd": "compare_months"}, user_id)
+        res, screen = await asyncio.gather(gas_request({"cmd": "compare_months"}, user_id), fetch_main_screen(user_id))
         year   = res.get("year", 2026)
         months = res.get("months", [])
-        text   = f"<b>📊 Сравнение месяцев ({year})</b>\n\n"
+        parts  = [f"<b>📊 Сравнение месяцев ({year})</b>\n\n"]
         for i, month_data in enumerate(months):
             month_name = month_data.get("month", "")
             incomes    = month_data.get("incomes", 0)
             expenses   = month_data.get("expenses", 0)
-            text += f"<b>{month_name}:</b>\n"
-            text += f"💰 Выручка: <b>{incomes:,.0f}</b> ₽"
+            parts.append(f"<b>{month_name}:</b>\n")
+            parts.append(f"💰 Выручка: <b>{fmt_money(incomes, 0)}</b> ₽")
             if i > 0:
                 prev_inc = months[i - 1].get("incomes", 0)
                 if prev_inc > 0:
                     change = ((incomes - prev_inc) / prev_inc) * 100
-                    text += f" ({'+' if change >= 0 else ''}{change:.0f}%)"
-            text += f"\n💸 Затраты: <b>{expenses:,.0f}</b> ₽"
+                    parts.append(f" ({'+' if change >= 0 else ''}{change:.0f}%)")
+            parts.append(f"\n💸 Затраты: <b>{fmt_money(expenses, 0)}</b> ₽")
             if i > 0:
                 prev_exp = months[i - 1].get("expenses", 0)
                 if prev_exp > 0:
                     change = ((expenses - prev_exp) / prev_exp) * 100
-                    text += f" ({'+' if change >= 0 else ''}{change:.0f}%)"
-            text += "\n\n"
-        text = text.replace(",", " ")
+                    parts.append(f" ({'+' if change >= 0 else ''}{change:.0f}%)")
+            parts.append("\n\n")
 
     elif q.data == "special:average":
-        res        = await gas_request({"cmd": "average_check"}, user_id)
+        res, screen = await asyncio.gather(gas_request({"cmd": "average_check"}, user_id), fetch_main_screen(user_id))
         month_data = res.get("month", {})
         year_data  = res.get("year", {})
-        text = "<b>💰 Средний чек</b>\n\n"
-        text += f"<b>За {month_data.get('month_label', 'месяц')}:</b>\n"
-        text += f"Средний чек: <b>{month_data.get('average', 0):,.0f}</b> ₽\n"
-        text += f"Операций: {month_data.get('count', 0)}\n\n"
-        text += f"<b>За {year_data.get('year_label', 'год')} год:</b>\n"
-        text += f"Средний чек: <b>{year_data.get('average', 0):,.0f}</b> ₽\n"
-        text += f"Операций: {year_data.get('count', 0)}"
-        text = text.replace(",", " ")
+        parts = ["<b>💰 Средний чек</b>\n\n"]
+        parts.append(f"<b>За {month_data.get('month_label', 'месяц')}:</b>\n")
+        parts.append(f"Средний чек: <b>{fmt_money(month_data.get('average', 0), 0)}</b> ₽\n")
+        parts.append(f"Операций: {month_data.get('count', 0)}\n\n")
+        parts.append(f"<b>За {year_data.get('year_label', 'год')} год:</b>\n")
+        parts.append(f"Средний чек: <b>{fmt_money(year_data.get('average', 0), 0)}</b> ₽\n")
+        parts.append(f"Операций: {year_data.get('count', 0)}")
 
     elif q.data == "special:top":
-        res        = await gas_request({"cmd": "top_expenses"}, user_id)
+        res, screen = await asyncio.gather(gas_request({"cmd": "top_expenses"}, user_id), fetch_main_screen(user_id))
         month_label = res.get("month_label", "месяц")
         total      = res.get("total", 0)
         categories = res.get("categories", [])
-        text = f"<b>📋 Топ категорий затрат ({month_label})</b>\n\n"
+        parts = [f"<b>📋 Топ категорий затрат ({month_label})</b>\n\n"]
         if categories:
             for i, cat_data in enumerate(categories, 1):
-                text += f"{i}. {cat_data.get('category', '')}: <b>{cat_data.get('amount', 0):,.0f}</b> ₽\n"
-            text += f"━━━━━━━━━━━━━━━━\nИтого: <b>{total:,.0f}</b> ₽"
+                parts.append(f"{i}. {cat_data.get('category', '')}: <b>{fmt_money(cat_data.get('amount', 0), 0)}</b> ₽\n")
+            parts.append(f"━━━━━━━━━━━━━━━━\nИтого: <b>{fmt_money(total, 0)}</b> ₽")
         else:
-            text += "Нет данных"
-        text = text.replace(",", " ")
+            parts.append("Нет данных")
 
     else:
-        text = "Неизвестный отчёт"
+        parts  = ["Неизвестный отчёт"]
+        screen = await fetch_main_screen(user_id)
 
-    await update.effective_chat.send_message(text, parse_mode=ParseMode.HTML)
-    txt, kb = await get_main_screen(user_id)
-    await update.effective_chat.send_message(txt, reply_markup=kb, parse_mode=ParseMode.HTML)
+    await send_with_screen(update, "".join(parts), screen)
     return ST_MENU
 
 
@@ -1060,7 +1396,7 @@ async def balance_edit_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await q.answer("Доступ запрещён", show_alert=True)
         return ST_MENU
 
-    payment_type = q.data.split(":")[1]
+    payment_type = q.data.partition(":")[2]
     context.user_data["balance_payment_type"] = payment_type
     labels = {"cash": "наличных", "bn": "БН"}
     label  = labels.get(payment_type, "")
@@ -1082,10 +1418,7 @@ async def balance_edit_received(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text(DENY_TEXT)
         return ConversationHandler.END
 
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    delete_user_message(update, context)
 
     user_id = update.effective_user.id
 
@@ -1095,7 +1428,7 @@ async def balance_edit_received(update: Update, context: ContextTypes.DEFAULT_TY
 
     amt = parse_amount(update.message.text)
     if amt is None or amt < 0:
-        await delete_working_message(context, update.effective_chat.id)
+        delete_working_message(context, update.effective_chat.id)
         msg = await update.effective_chat.send_message(
             "Не понял сумму 🙈\nНапиши, пожалуйста, например: 50000 / 50 000 / 50к"
         )
@@ -1103,18 +1436,12 @@ async def balance_edit_received(update: Update, context: ContextTypes.DEFAULT_TY
         return ST_BALANCE_EDIT
 
     payment_type = context.user_data.get("balance_payment_type", "cash")
-    await gas_request({"cmd": "set_balance", "amount": amt, "payment_type": payment_type}, user_id)
-    await delete_working_message(context, update.effective_chat.id)
+    await gas_write({"cmd": "set_balance", "amount": amt, "payment_type": payment_type}, user_id)
+    delete_working_message(context, update.effective_chat.id)
 
     labels = {"cash": "наличных", "bn": "БН счета"}
     label  = labels.get(payment_type, "")
-    await update.effective_chat.send_message(
-        f"Отлично! ✅ Баланс {label} установлен: <b>{amt:,.2f}</b> ₽".replace(",", " "),
-        parse_mode=ParseMode.HTML
-    )
-
-    txt, kb = await get_main_screen(user_id)
-    await update.effective_chat.send_message(txt, reply_markup=kb, parse_mode=ParseMode.HTML)
+    await send_main_screen(update, user_id, f"Отлично! ✅ Баланс {label} установлен: <b>{fmt_money(amt)}</b> ₽")
     return ST_MENU
 
 
@@ -1139,7 +1466,7 @@ async def debts_select_debtor(update: Update, context: ContextTypes.DEFAULT_TYPE
         context.user_data["working_message_id"] = q.message.message_id
         return ST_DEBTS_ADD_NAME
 
-    debtor_id = int(q.data.split(":")[1])
+    debtor_id = int(q.data.partition(":")[2])
     context.user_data["debtor_id"] = debtor_id
 
     debt_type = context.user_data.get("debt_type", "owe_me")
@@ -1153,8 +1480,8 @@ async def debts_select_debtor(update: Update, context: ContextTypes.DEFAULT_TYPE
     context.user_data["debtor_name"] = debtor["name"]
     text = (
         f"<b>{debtor['name']}</b>\n"
-        f"Текущий долг: <b>{debtor['amount']:,.2f}</b> ₽\n\n"
-    ).replace(",", " ")
+        f"Текущий долг: <b>{fmt_money(debtor['amount'])}</b> ₽\n\n"
+    )
     text += "Выбери действие:"
 
     owner_mode = is_owner(user_id)
@@ -1181,11 +1508,9 @@ async def debtor_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await q.answer("Доступ запрещён", show_alert=True)
             return ST_DEBTS_SELECT
         debtor_id = context.user_data.get("debtor_id")
-        await gas_request({"cmd": "delete_debtor", "debtor_id": debtor_id}, user_id)
-        await delete_working_message(context, update.effective_chat.id)
-        await update.effective_chat.send_message("✅ Должник удалён")
-        txt, kb = await get_main_screen(user_id)
-        await update.effective_chat.send_message(txt, reply_markup=kb, parse_mode=ParseMode.HTML)
+        await gas_write({"cmd": "delete_debtor", "debtor_id": debtor_id}, user_id)
+        delete_working_message(context, update.effective_chat.id)
+        await send_main_screen(update, user_id, "✅ Должник удалён")
         return ST_MENU
 
     return ST_DEBTS_SELECT
@@ -1196,16 +1521,13 @@ async def debts_amount_received(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text(DENY_TEXT)
         return ConversationHandler.END
 
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    delete_user_message(update, context)
 
     user_id = update.effective_user.id
     amt     = parse_amount(update.message.text)
 
     if amt is None or amt < 0:
-        await delete_working_message(context, update.effective_chat.id)
+        delete_working_message(context, update.effective_chat.id)
         msg = await update.effective_chat.send_message(
             "Не понял сумму 🙈\nНапиши, пожалуйста, например: 10000 / 10 000 / 10к или 0"
         )
@@ -1213,20 +1535,16 @@ async def debts_amount_received(update: Update, context: ContextTypes.DEFAULT_TY
         return ST_DEBTS_AMOUNT
 
     debtor_id = context.user_data.get("debtor_id")
-    await gas_request({"cmd": "update_debtor", "debtor_id": debtor_id, "amount": amt}, user_id)
-    await delete_working_message(context, update.effective_chat.id)
+    await gas_write({"cmd": "update_debtor", "debtor_id": debtor_id, "amount": amt}, user_id)
+    delete_working_message(context, update.effective_chat.id)
 
     if amt == 0:
-        await update.effective_chat.send_message("✅ Долг закрыт")
+        confirm = "✅ Долг закрыт"
     else:
         debtor_name = context.user_data.get("debtor_name", "Должник")
-        await update.effective_chat.send_message(
-            f"✅ Обновлено!\n<b>{debtor_name}</b>: {amt:,.2f} ₽".replace(",", " "),
-            parse_mode=ParseMode.HTML
-        )
+        confirm     = f"✅ Обновлено!\n<b>{html.escape(debtor_name)}</b>: {fmt_money(amt)} ₽"
 
-    txt, kb = await get_main_screen(user_id)
-    await update.effective_chat.send_message(txt, reply_markup=kb, parse_mode=ParseMode.HTML)
+    await send_main_screen(update, user_id, confirm)
     return ST_MENU
 
 
@@ -1235,14 +1553,11 @@ async def debts_add_name_received(update: Update, context: ContextTypes.DEFAULT_
         await update.message.reply_text(DENY_TEXT)
         return ConversationHandler.END
 
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    delete_user_message(update, context)
 
     debtor_name = (update.message.text or "").strip()
     if not debtor_name:
-        await delete_working_message(context, update.effective_chat.id)
+        delete_working_message(context, update.effective_chat.id)
         msg = await update.effective_chat.send_message("Имя обязательно! Напиши:")
         context.user_data["working_message_id"] = msg.message_id
         return ST_DEBTS_ADD_NAME
@@ -1267,14 +1582,11 @@ async def debts_add_amount_received(update: Update, context: ContextTypes.DEFAUL
         await update.message.reply_text(DENY_TEXT)
         return ConversationHandler.END
 
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    delete_user_message(update, context)
 
     amt = parse_amount(update.message.text)
     if amt is None or amt <= 0:
-        await delete_working_message(context, update.effective_chat.id)
+        delete_working_message(context, update.effective_chat.id)
         msg = await update.effective_chat.send_message(
             "Не понял сумму 🙈\nНапиши, пожалуйста, например: 5000 / 5 000 / 5к"
         )
@@ -1290,7 +1602,7 @@ async def debts_add_amount_received(update: Update, context: ContextTypes.DEFAUL
             await context.bot.edit_message_text(
                 chat_id=update.effective_chat.id,
                 message_id=work_msg_id,
-                text=f"<b>{debtor_name}</b>\nСумма: {amt:,.0f} ₽\n\nВыбери форму оплаты:".replace(",", " "),
+                text=f"<b>{debtor_name}</b>\nСумма: {fmt_money(amt, 0)} ₽\n\nВыбери форму оплаты:",
                 reply_markup=kb_debt_payment(),
                 parse_mode=ParseMode.HTML
             )
@@ -1302,7 +1614,7 @@ async def debts_add_amount_received(update: Update, context: ContextTypes.DEFAUL
 async def debts_add_payment_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    payment_choice = q.data.split(":")[1]
+    payment_choice = q.data.partition(":")[2]
     payment_type   = "Наличные" if payment_choice == "cash" else "БН (QR и счёт)"
     context.user_data["new_debtor_payment"] = payment_type
 
@@ -1311,9 +1623,9 @@ async def debts_add_payment_selected(update: Update, context: ContextTypes.DEFAU
 
     await q.edit_message_text(
         f"<b>{debtor_name}</b>\n"
-        f"Сумма: {amount:,.0f} ₽\n"
+        f"Сумма: {fmt_money(amount, 0)} ₽\n"
         f"Форма оплаты: {payment_type}\n\n"
-        f"Добавить комментарий?\n(или напиши <code>-</code> чтобы пропустить)".replace(",", " "),
+        f"Добавить комментарий?\n(или напиши <code>-</code> чтобы пропустить)",
         parse_mode=ParseMode.HTML
     )
     context.user_data["working_message_id"] = q.message.message_id
@@ -1325,10 +1637,7 @@ async def debts_add_comment_received(update: Update, context: ContextTypes.DEFAU
         await update.message.reply_text(DENY_TEXT)
         return ConversationHandler.END
 
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    delete_user_message(update, context)
 
     user_id     = update.effective_user.id
     comment     = (update.message.text or "").strip()
@@ -1340,7 +1649,7 @@ async def debts_add_comment_received(update: Update, context: ContextTypes.DEFAU
     debt_type    = context.user_data.get("debt_type", "owe_me")
     payment_type = context.user_data.get("new_debtor_payment", "Наличные")
 
-    await delete_working_message(context, update.effective_chat.id)
+    delete_working_message(context, update.effective_chat.id)
 
     payload = {
         "cmd":          "add_debtor",
@@ -1352,16 +1661,12 @@ async def debts_add_comment_received(update: Update, context: ContextTypes.DEFAU
     }
 
     try:
-        await gas_request(payload, user_id)
-        await update.effective_chat.send_message(
-            f"✅ Долг записан!\n<b>{debtor_name}</b>: {amount:,.0f} ₽".replace(",", " "),
-            parse_mode=ParseMode.HTML
-        )
+        await gas_write(payload, user_id)
+        result = f"✅ Долг записан!\n<b>{html.escape(debtor_name)}</b>: {fmt_money(amount, 0)} ₽"
     except Exception as e:
-        await update.effective_chat.send_message(f"Ошибка: {e}")
+        result = f"Ошибка: {html.escape(str(e))}"
 
-    txt, kb = await get_main_screen(user_id)
-    await update.effective_chat.send_message(txt, reply_markup=kb, parse_mode=ParseMode.HTML)
+    await send_main_screen(update, user_id, result)
     return ST_MENU
 
 
@@ -1373,21 +1678,16 @@ async def film_client_received(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text(DENY_TEXT)
         return ConversationHandler.END
 
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    delete_user_message(update, context)
 
     client_name = (update.message.text or "").strip()
     if not client_name:
-        await delete_working_message(context, update.effective_chat.id)
+        delete_working_message(context, update.effective_chat.id)
         msg = await update.effective_chat.send_message("Имя клиента обязательно! Напиши:")
         context.user_data["working_message_id"] = msg.message_id
         return ST_FILM_CLIENT
 
-    film = context.user_data.get("film", {})
-    film["client"] = client_name
-    context.user_data["film"] = film
+    context.user_data.setdefault("film", {})["client"] = client_name
 
     work_msg_id = context.user_data.get("working_message_id")
     if work_msg_id:
@@ -1407,10 +1707,7 @@ async def film_meters_received(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text(DENY_TEXT)
         return ConversationHandler.END
 
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    delete_user_message(update, context)
 
     meters_text = (update.message.text or "").strip()
     try:
@@ -1418,16 +1715,14 @@ async def film_meters_received(update: Update, context: ContextTypes.DEFAULT_TYP
         if meters <= 0:
             raise ValueError
     except Exception:
-        await delete_working_message(context, update.effective_chat.id)
+        delete_working_message(context, update.effective_chat.id)
         msg = await update.effective_chat.send_message(
             "Не понял количество 🙈\nНапиши, пожалуйста, например: 5 или 5.5"
         )
         context.user_data["working_message_id"] = msg.message_id
         return ST_FILM_METERS
 
-    film = context.user_data.get("film", {})
-    film["meters"] = meters
-    context.user_data["film"] = film
+    context.user_data.setdefault("film", {})["meters"] = meters
 
     work_msg_id = context.user_data.get("working_message_id")
     if work_msg_id:
@@ -1448,23 +1743,19 @@ async def film_amount_received(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text(DENY_TEXT)
         return ConversationHandler.END
 
-    try:
-        await update.message.delete()
-    except Exception:
-        pass
+    delete_user_message(update, context)
 
     amt = parse_amount(update.message.text)
     if amt is None or amt <= 0:
-        await delete_working_message(context, update.effective_chat.id)
+        delete_working_message(context, update.effective_chat.id)
         msg = await update.effective_chat.send_message(
             "Не понял сумму 🙈\nНапиши, пожалуйста, например: 2500 / 2 500 / 2к"
         )
         context.user_data["working_message_id"] = msg.message_id
         return ST_FILM_AMOUNT
 
-    film = context.user_data.get("film", {})
+    film = context.user_data.setdefault("film", {})
     film["amount"] = amt
-    context.user_data["film"] = film
 
     work_msg_id = context.user_data.get("working_message_id")
     if work_msg_id:
@@ -1475,9 +1766,9 @@ async def film_amount_received(update: Update, context: ContextTypes.DEFAULT_TYP
                 f"📦 Продал пленку\n\n"
                 f"Клиент: <b>{client}</b>\n"
                 f"Метров: <b>{meters}</b>\n"
-                f"Сумма: <b>{amt:,.0f}</b> ₽\n\n"
+                f"Сумма: <b>{fmt_money(amt, 0)}</b> ₽\n\n"
                 f"Как оплатили?"
-            ).replace(",", " ")
+            )
             await context.bot.edit_message_text(
                 chat_id=update.effective_chat.id,
                 message_id=work_msg_id,
@@ -1494,14 +1785,14 @@ async def film_payment_selected(update: Update, context: ContextTypes.DEFAULT_TY
     q = update.callback_query
     await q.answer()
     user_id        = update.effective_user.id
-    payment_choice = q.data.split(":")[1]
+    payment_choice = q.data.partition(":")[2]
 
     film   = context.user_data.get("film", {})
     client = film.get("client", "")
     meters = film.get("meters", 0)
     amount = film.get("amount", 0)
 
-    await delete_working_message(context, update.effective_chat.id)
+    delete_working_message(context, update.effective_chat.id)
 
     if payment_choice == "debt":
         comment = f"Пленка {meters} м"
@@ -1515,15 +1806,14 @@ async def film_payment_selected(update: Update, context: ContextTypes.DEFAULT_TY
             "allow_any":    True   # разрешаем admin добавлять долг через пленку
         }
         try:
-            await gas_request(payload, user_id)
-            await update.effective_chat.send_message(
+            await gas_write(payload, user_id)
+            result = (
                 f"✅ Записано в долг!\n"
-                f"<b>{client}</b>: {amount:,.0f} ₽\n"
-                f"({meters} м пленки)".replace(",", " "),
-                parse_mode=ParseMode.HTML
+                f"<b>{html.escape(client)}</b>: {fmt_money(amount, 0)} ₽\n"
+                f"({meters} м пленки)"
             )
         except Exception as e:
-            await update.effective_chat.send_message(f"Ошибка: {e}")
+            result = f"Ошибка: {html.escape(str(e))}"
     else:
         category     = "Наличные"       if payment_choice == "cash" else "БН (QR и счёт)"
         payment_type = "Наличные"       if payment_choice == "cash" else "БН (QR и счёт)"
@@ -1537,18 +1827,17 @@ async def film_payment_selected(update: Update, context: ContextTypes.DEFAULT_TY
             "comment":      comment
         }
         try:
-            await gas_request(payload, user_id)
-            emoji = "💵" if payment_choice == "cash" else "🏢"
-            await update.effective_chat.send_message(
+            await gas_write(payload, user_id)
+            emoji  = "💵" if payment_choice == "cash" else "🏢"
+            result = (
                 f"✅ Записано!\n"
-                f"{emoji} {category} — {amount:,.0f} ₽\n"
-                f"{client} — {meters} м пленки".replace(",", " ")
+                f"{emoji} {category} — {fmt_money(amount, 0)} ₽\n"
+                f"{html.escape(client)} — {meters} м пленки"
             )
         except Exception as e:
-            await update.effective_chat.send_message(f"Ошибка: {e}")
+            result = f"Ошибка: {html.escape(str(e))}"
 
-    txt, kb = await get_main_screen(user_id)
-    await update.effective_chat.send_message(txt, reply_markup=kb, parse_mode=ParseMode.HTML)
+    await send_main_screen(update, user_id, result)
     return ST_MENU
 
 
@@ -1562,6 +1851,14 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Кнопки внизу 🙂\nЕсли что-то не работает — напиши /start")
 
 
+async def cmd_reload_cats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_allowed(update) or not is_owner(update.effective_user.id):
+        await update.message.reply_text(DENY_TEXT)
+        return
+    gas_cache_invalidate(include_static=True)
+    await update.message.reply_text("Готово ✅ Категории перечитаю из таблицы при следующем вводе.")
+
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     logger.exception("Unhandled error: %s", context.error)
     try:
@@ -1574,8 +1871,44 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
 # ========================================
 # BUILD APP
 # ========================================
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Апдейты разных пользователей обрабатываются параллельно,
+    а апдейты одного пользователя — строго по очереди
+    (ConversationHandler не рассчитан на параллельные переходы одного диалога).
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await coroutine
+            return
+        lock = self._locks.get(user.id)
+        if lock is None:
+            lock = self._locks[user.id] = asyncio.Lock()
+        async with lock:
+            await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
 def build_app() -> Application:
-    app = ApplicationBuilder().token(BOT_TOKEN).post_shutdown(_on_shutdown).build()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_init(_on_startup)
+        .post_shutdown(_on_shutdown)
+        .build()
+    )
 
     conv = ConversationHandler(
         entry_points=[CommandHandler("start", cmd_start)],
@@ -1662,21 +1995,30 @@ def build_app() -> Application:
 
     app.add_handler(conv)
     app.add_handler(CommandHandler("help", cmd_help))
+    app.add_handler(CommandHandler("reload_cats", cmd_reload_cats))
     app.add_error_handler(error_handler)
     return app
 
 
+async def _on_startup(app: Application) -> None:
+    """Открываем GAS session заранее, чтобы первый запрос не ждал её создания."""
+    await _get_gas_session()
+
+
 async def _on_shutdown(app: Application) -> None:
     """Graceful shutdown: закрываем persistent GAS session."""
     await _close_gas_session()
 
 
 def run():
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     app = build_app()
     if WEBHOOK_URL:
         url_path     = WEBHOOK_PATH or _default_webhook_path()
         full_webhook = f"{WEBHOOK_URL.rstrip('/')}/{url_path}"
-        logger.info("Starting webhook on 0.0.0.0:%s", PORT)
+        # TLS терминирует прокси платформы, сам бот слушает обычный HTTP (без cert/key)
+        logger.info("Starting webhook on 0.0.0.0:%s (event loop: %s)", PORT, "uvloop" if uvloop else "asyncio")
         app.run_webhook(
             listen="0.0.0.0",
             port=PORT,